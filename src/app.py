@@ -7,12 +7,23 @@ Actualizado para eliminar reseteos fantasma ("Modulo Problem").
 from flask import Flask, request, jsonify, make_response
 from functools import wraps
 import json
+import math
 import os
 import numpy as np
 import tensorflow as tf
 import pickle
 from dotenv import load_dotenv
 from datetime import datetime
+from threading import Lock
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+import cache_respuestas
+import caracteristicas
+import perfilado
 
 load_dotenv()
 app = Flask(__name__)
@@ -31,6 +42,9 @@ ARCHIVO_ENTRENAMIENTO = ARCHIVO_HISTORIAL
 print("\n⏳ Cargando Nueva IA Robusta (V2)...\n")
 
 try:
+    # Rechazar modelos entrenados con otras features antes de cargar nada
+    caracteristicas.verificar_esquema(DIR_MODELOS)
+
     path_model = os.path.join(DIR_MODELOS, 'modelo_desgaste_v2.h5')
     model = tf.keras.models.load_model(path_model)
     
@@ -58,35 +72,131 @@ def cargar_base_conocimiento():
 
 datos_motos = cargar_base_conocimiento()
 
+def indexar_tareas(base):
+    """
+    {modelo_id: {componente_id: tarea}} para no recorrer la lista de tareas en
+    cada reporte. Se conserva la PRIMERA tarea de cada componente (igual que next()).
+    """
+    indice = {}
+    for modelo_id, moto in base.items():
+        por_comp = indice.setdefault(modelo_id, {})
+        for t in moto.get('tareas_mantenimiento', []):
+            por_comp.setdefault(t['componente_id'], t)
+    return indice
+
+indice_tareas = indexar_tareas(datos_motos)
+
+# --- IDEMPOTENCIA DE REPORTES ---
+# La clave_idempotencia es única GLOBALMENTE (entre todos los usuarios), no por usuario.
+# Varios workers escriben el mismo historial, así que la comprobación + escritura se
+# hace con un bloqueo de SO sobre ARCHIVO_HISTORIAL.lock y, antes de comprobar,
+# cada proceso lee las líneas que otros hayan añadido desde su última lectura.
+MAX_REPORTES_LOTE = int(os.getenv("MAX_REPORTES_LOTE", "500"))
+ARCHIVO_LOCK_HISTORIAL = ARCHIVO_HISTORIAL + '.lock'
+lock_historial = Lock()  # Hilos del mismo proceso
+claves_guardadas = set()
+offset_historial = 0     # Bytes del historial ya leídos por este proceso
+
+def sincronizar_claves_idempotencia():
+    """Añade a claves_guardadas las claves de las líneas nuevas del historial."""
+    global offset_historial
+    if not os.path.exists(ARCHIVO_HISTORIAL): return
+    with open(ARCHIVO_HISTORIAL, 'rb') as f:
+        f.seek(offset_historial)
+        for line in f:
+            if not line.endswith(b'\n'): break  # Línea a medio escribir
+            offset_historial += len(line)
+            try:
+                clave = json.loads(line).get('clave_idempotencia')
+            except (ValueError, AttributeError):
+                continue
+            if clave: claves_guardadas.add(clave)
+
+@contextmanager
+def bloqueo_historial():
+    """Exclusión entre hilos y procesos para comprobar claves y escribir el historial."""
+    os.makedirs(os.path.dirname(ARCHIVO_LOCK_HISTORIAL), exist_ok=True)
+    with lock_historial, open(ARCHIVO_LOCK_HISTORIAL, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            sincronizar_claves_idempotencia()
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+sincronizar_claves_idempotencia()
+
+# --- PERFILADO (opcional, ver perfilado.py) ---
+def metadatos_perfil():
+    data = request.get_json(force=True, silent=True) or {}
+    if isinstance(data, list): return {"num_reportes": len(data)}
+    if not isinstance(data, dict): return {}
+    modelo_id = data.get('modelo_id')
+    tareas = datos_motos.get(modelo_id, {}).get('tareas_mantenimiento', []) if modelo_id else []
+    return {"modelo_id": modelo_id, "num_tareas": len(tareas)}
+
+perfilador = perfilado.Perfilador.desde_entorno(metadatos=metadatos_perfil)
+if perfilador.activo:
+    print(f"🔬 Perfilado activo (tasa: {perfilador.tasa}, dir: {perfilador.directorio})")
+
+# --- CACHÉ DE RESPUESTAS (opcional, ver cache_respuestas.py) ---
+cache = cache_respuestas.crear_desde_entorno()
+if cache is not None:
+    # La clave incluye las versiones del modelo y del catálogo cargados
+    VERSION_MODELO = "offline" if model is None else "-".join(
+        cache_respuestas.hash_archivo(os.path.join(DIR_MODELOS, n))
+        for n in ('modelo_desgaste_v2.h5', 'scaler.pkl', 'encoder.pkl')
+    ) + f"-f{caracteristicas.VERSION_ESQUEMA}"
+    VERSION_CATALOGO = cache_respuestas.hash_archivo(ARCHIVO_BASE)
+    print(f"🗃️  Caché de respuestas activa: {type(cache).__name__} (TTL {cache.ttl}s)")
+
+def responder_cacheado(etag, cuerpo, estado_cache):
+    """304 si el cliente ya tiene este ETag; si no, los bytes tal cual."""
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(cuerpo, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['X-Cache'] = estado_cache
+    return resp
+
 # --- LÓGICA DE PREDICCIÓN ---
 
-def consultar_ia_robusta(km_pieza_actual, intervalo_manual):
-    if model is None or scaler is None: return "IA_OFFLINE", 0.0
+def consultar_ia_lote(kms_pieza, intervalos):
+    """
+    Una sola pasada de scaler + modelo para todas las piezas.
+    Devuelve (estados, confianzas) como listas de la misma longitud.
+    """
+    n = len(kms_pieza)
+    if model is None or scaler is None: return ["IA_OFFLINE"] * n, [0.0] * n
+    if n == 0: return [], []
     
     try:
-        epsilon = 1e-6
-        ratio = km_pieza_actual / (intervalo_manual + epsilon)
-        diff = km_pieza_actual - intervalo_manual
-        
-        vector_crudo = np.array([[
-            km_pieza_actual,
-            intervalo_manual,
-            ratio,
-            diff
-        ]])
-        
+        vector_crudo = caracteristicas.construir_features(kms_pieza, intervalos)
         vector_scaled = scaler.transform(vector_crudo)
         prediccion = model.predict(vector_scaled, verbose=0)
         
-        clase_idx = np.argmax(prediccion)
-        estado = encoder.inverse_transform([clase_idx])[0]
-        confianza = float(np.max(prediccion))
+        clases_idx = np.argmax(prediccion, axis=1)
+        estados = encoder.inverse_transform(clases_idx).tolist()
+        confianzas = np.max(prediccion, axis=1).astype(float).tolist()
         
-        return estado, confianza
+        return estados, confianzas
         
     except Exception as e:
         print(f"Error IA: {e}")
-        return "ERROR_CALCULO", 0.0
+        return ["ERROR_CALCULO"] * n, [0.0] * n
+
+def consultar_ia_robusta(km_pieza_actual, intervalo_manual):
+    estados, confianzas = consultar_ia_lote([km_pieza_actual], [intervalo_manual])
+    return estados[0], confianzas[0]
 
 def analizar_mantenimiento(perfil_moto_id, km_moto_total, historial_usuario):
     """
@@ -96,7 +206,7 @@ def analizar_mantenimiento(perfil_moto_id, km_moto_total, historial_usuario):
     if perfil_moto_id not in datos_motos: return []
     
     tareas = datos_motos[perfil_moto_id]["tareas_mantenimiento"]
-    resultados = []
+    piezas = []
 
     for tarea in tareas:
         comp_id = tarea["componente_id"]
@@ -121,10 +231,18 @@ def analizar_mantenimiento(perfil_moto_id, km_moto_total, historial_usuario):
         
         # Evitar negativos
         km_recorridos_pieza = max(0, km_recorridos_pieza)
+        piezas.append((tarea, intervalo_manual, origen_dato, km_recorridos_pieza))
+
+    # B. CONSULTAR A LA IA (todas las piezas en un único lote)
+    estados_ia, confianzas_ia = consultar_ia_lote(
+        [p[3] for p in piezas], [p[1] for p in piezas]
+    )
+
+    resultados = []
+    for (tarea, intervalo_manual, origen_dato, km_recorridos_pieza), estado_ia, confianza_ia \
+            in zip(piezas, estados_ia, confianzas_ia):
+        comp_id = tarea["componente_id"]
 
-        # B. CONSULTAR A LA IA
-        estado_ia, confianza_ia = consultar_ia_robusta(km_recorridos_pieza, intervalo_manual)
-        
         # C. CÁLCULO DE URGENCIA
         urgencia_matematica = km_recorridos_pieza / intervalo_manual
         
@@ -169,6 +287,7 @@ def auth_required(f):
 
 @app.route('/predict_full', methods=['POST'])
 @auth_required
+@perfilador.perfilar
 def predict_full():
     try:
         data = request.get_json(force=True)
@@ -179,19 +298,39 @@ def predict_full():
         if not modelo_id or km_actual is None:
             return jsonify({"error": "Faltan datos"}), 400
 
+        clave = None
+        if cache is not None:
+            canonico = cache_respuestas.canonizar(modelo_id, km_actual, historial)
+            clave = cache_respuestas.construir_clave(canonico, VERSION_MODELO, VERSION_CATALOGO)
+            entrada = cache.obtener(clave)
+            if entrada is not None:
+                return responder_cacheado(*entrada, estado_cache='HIT')
+
         analisis = analizar_mantenimiento(modelo_id, float(km_actual), historial)
         
-        return jsonify({
+        respuesta = jsonify({
             "moto": modelo_id,
             "km_total": km_actual,
             "diagnostico_global": analisis
         })
+        if clave is None:
+            return respuesta
+
+        # Los fallos puntuales de la IA no se cachean
+        if any(a['analisis_ia']['diagnostico'] == 'ERROR_CALCULO' for a in analisis):
+            return respuesta
+
+        cuerpo = respuesta.get_data()
+        etag = cache_respuestas.calcular_etag(cuerpo)
+        cache.guardar(clave, etag, cuerpo)
+        return responder_cacheado(etag, cuerpo, estado_cache='MISS')
 
     except Exception as e:
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
 
 @app.route('/test_single', methods=['POST'])
 @auth_required
+@perfilador.perfilar
 def test_single():
     try:
         data = request.get_json(force=True)
@@ -242,53 +381,165 @@ def get_maintenance_options():
     
     return jsonify(lista_final)
 
+def intervalo_tarea(modelo_id, componente_id):
+    tarea = indice_tareas.get(modelo_id, {}).get(componente_id)
+    if not tarea or 'intervalo' not in tarea: return 0
+    return tarea['intervalo'].get('kilometros') or 0
+
+def calcular_km_teorico(modelo_id, componente_id, km_realizado):
+    """km_recomendacion_app: final del ciclo de mantenimiento más cercano al km reportado."""
+    return int(caracteristicas.km_recomendado(km_realizado or 0, intervalo_tarea(modelo_id, componente_id))[0])
+
+def calcular_km_teorico_lote(reportes):
+    """Versión vectorizada de calcular_km_teorico para una lista de reportes."""
+    if not reportes: return []
+    intervalos = [intervalo_tarea(r.get('modelo_id'), r.get('componente_id')) for r in reportes]
+    kms = [r.get('km_realizado_usuario') or 0 for r in reportes]
+    return caracteristicas.km_recomendado(kms, intervalos).tolist()
+
+def construir_registro(data, km_teorico):
+    registro = {
+        "fecha_reporte": now_iso(),
+        "usuario_id_hash": data.get('usuario_id_hash'),
+        "modelo_id": data.get('modelo_id'),
+        "componente_id": data.get('componente_id'),
+        "accion_realizada": data.get('accion_realizada', 'REEMPLAZAR'),
+        "km_recomendacion_app": km_teorico,
+        "km_realizado_usuario": data.get('km_realizado_usuario'),
+        "condicion_reportada": data.get('condicion_reportada'),
+        "fecha_servidor": now_iso()
+    }
+    if data.get('clave_idempotencia'):
+        registro["clave_idempotencia"] = data['clave_idempotencia']
+    return registro
+
+def validar_km(km):
+    """None si km es aceptable (ausente o número finito en [0, KM_MAXIMO])."""
+    if km is None: return None
+    # get_json acepta NaN / Infinity / 1e300: el cast a int los convertiría en basura
+    if isinstance(km, bool) or not isinstance(km, (int, float)) \
+            or not 0 <= km <= caracteristicas.KM_MAXIMO or not math.isfinite(km):
+        return f"km_realizado_usuario debe ser un número entre 0 y {caracteristicas.KM_MAXIMO}"
+    return None
+
+def validar_clave(clave):
+    if clave is not None and not isinstance(clave, str):
+        return "clave_idempotencia debe ser texto"
+    return None
+
+def validar_reporte(data):
+    """Devuelve un mensaje de error o None si el reporte es válido."""
+    if not isinstance(data, dict): return "El reporte debe ser un objeto JSON"
+    for campo in ('usuario_id_hash', 'modelo_id', 'componente_id', 'condicion_reportada'):
+        if not data.get(campo): return f"Falta {campo}"
+        if not isinstance(data[campo], str): return f"{campo} debe ser texto"
+    return validar_km(data.get('km_realizado_usuario')) or validar_clave(data.get('clave_idempotencia'))
+
+def guardar_registros(registros):
+    """Escribe todos los registros en un único append."""
+    if not registros: return
+    os.makedirs(os.path.dirname(ARCHIVO_ENTRENAMIENTO), exist_ok=True)
+    with open(ARCHIVO_ENTRENAMIENTO, 'a', encoding='utf-8') as f:
+        f.write("".join(json.dumps(r) + "\n" for r in registros))
+
 @app.route('/reportar_mantenimiento', methods=['POST'])
 @auth_required
+@perfilador.perfilar
 def reportar():
     try:
         data = request.get_json(force=True, silent=True)
         if not data: return jsonify({"error": "JSON vacío"}), 400
 
-        usuario_id_hash = data.get('usuario_id_hash')
-        modelo_id = data.get('modelo_id')
-        componente_id = data.get('componente_id')
-        accion_realizada = data.get('accion_realizada', 'REEMPLAZAR')
-        km_realizado = data.get('km_realizado_usuario')
-        condicion_reportada = data.get('condicion_reportada')
-
-        km_teorico = 0
-        if modelo_id in datos_motos:
-            tareas = datos_motos[modelo_id].get('tareas_mantenimiento', [])
-            tarea = next((t for t in tareas if t['componente_id'] == componente_id), None)
-            
-            if tarea and 'intervalo' in tarea:
-                intervalo = tarea['intervalo'].get('kilometros', 0)
-                if intervalo > 0 and km_realizado:
-                    ciclo = round(km_realizado / intervalo)
-                    if ciclo < 1: ciclo = 1
-                    km_teorico = intervalo * ciclo
-
-        registro_ordenado = {
-            "fecha_reporte": now_iso(),
-            "usuario_id_hash": usuario_id_hash,
-            "modelo_id": modelo_id,
-            "componente_id": componente_id,
-            "accion_realizada": accion_realizada,
-            "km_recomendacion_app": km_teorico,
-            "km_realizado_usuario": km_realizado,
-            "condicion_reportada": condicion_reportada,
-            "fecha_servidor": now_iso()
-        }
-
-        os.makedirs(os.path.dirname(ARCHIVO_ENTRENAMIENTO), exist_ok=True)
-        with open(ARCHIVO_ENTRENAMIENTO, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(registro_ordenado) + "\n")
+        error = validar_km(data.get('km_realizado_usuario')) or validar_clave(data.get('clave_idempotencia'))
+        if error: return jsonify({"error": error}), 400
+
+        km_teorico = calcular_km_teorico(
+            data.get('modelo_id'), data.get('componente_id'), data.get('km_realizado_usuario')
+        )
+        registro_ordenado = construir_registro(data, km_teorico)
+
+        clave = registro_ordenado.get('clave_idempotencia')
+        with bloqueo_historial():
+            if clave and clave in claves_guardadas:
+                return jsonify({"status": "duplicate", "clave_idempotencia": clave}), 200
+            guardar_registros([registro_ordenado])
+            if clave: claves_guardadas.add(clave)
             
         return jsonify({"status": "saved", "enriched_data": registro_ordenado}), 201
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@app.route('/reportar_mantenimiento_batch', methods=['POST'])
+@auth_required
+@perfilador.perfilar
+def reportar_batch():
+    """
+    Recibe una lista de reportes (o {"reportes": [...]}) y devuelve el estado de
+    cada uno en el mismo orden: saved | duplicate | invalid.
+    """
+    try:
+        data = request.get_json(force=True, silent=True)
+        reportes = data.get('reportes') if isinstance(data, dict) else data
+        if not isinstance(reportes, list) or not reportes:
+            return jsonify({"error": "Se esperaba una lista de reportes"}), 400
+        if len(reportes) > MAX_REPORTES_LOTE:
+            return jsonify({"error": f"Máximo {MAX_REPORTES_LOTE} reportes por lote"}), 413
+
+        # 1. Validar todo el lote
+        errores = [validar_reporte(r) for r in reportes]
+        validos = [i for i, err in enumerate(errores) if err is None]
+
+        # 2. Enriquecer (cálculo de ciclos vectorizado)
+        kms_teoricos = calcular_km_teorico_lote([reportes[i] for i in validos])
+        registros = {i: construir_registro(reportes[i], km) for i, km in zip(validos, kms_teoricos)}
+
+        # 3. Deduplicar y guardar en un único append
+        resultados = [None] * len(reportes)
+        with bloqueo_historial():
+            a_guardar = []
+            vistas = set()
+            for i in validos:
+                clave = registros[i].get('clave_idempotencia')
+                if clave and (clave in claves_guardadas or clave in vistas):
+                    resultados[i] = {"indice": i, "status": "duplicate", "clave_idempotencia": clave}
+                    continue
+                if clave: vistas.add(clave)
+                a_guardar.append(registros[i])
+                resultados[i] = {"indice": i, "status": "saved", "enriched_data": registros[i]}
+
+            guardar_registros(a_guardar)
+            claves_guardadas.update(vistas)
+
+        for i, err in enumerate(errores):
+            if err is not None:
+                resultados[i] = {"indice": i, "status": "invalid", "error": err}
+
+        resumen = {s: sum(1 for r in resultados if r["status"] == s) for s in ("saved", "duplicate", "invalid")}
+        codigo = 201 if resumen["saved"] else 200
+        return jsonify({"resumen": resumen, "resultados": resultados}), codigo
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     
+@app.route('/perfiles', methods=['GET'])
+@auth_required
+def listar_perfiles():
+    ultimos = request.args.get('ultimos', 20, type=int)
+    return jsonify(perfilado.listar_recientes(perfilador.directorio, ultimos))
+
+@app.route('/perfiles/<nombre>', methods=['GET'])
+@auth_required
+def ver_perfil(nombre):
+    if nombre not in perfilado.listar_nombres(perfilador.directorio):
+        return jsonify({"error": "Perfil no encontrado"}), 404
+    top = request.args.get('top', 15, type=int)
+    try:
+        return jsonify(perfilado.resumir(perfilador.directorio, nombre, top))
+    except FileNotFoundError:
+        # Rotado entre el listado y la lectura
+        return jsonify({"error": "Perfil no encontrado"}), 404
+
 def now_iso():
     return datetime.now().isoformat()
 
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+CACHÉ DE RESPUESTAS (opcional) PARA /predict_full.
+Con el mismo modelo y la misma base de conocimiento la respuesta es una función
+pura de (modelo_id, km_actual, historial_usuario), así que se guardan los bytes
+ya serializados junto a su ETag con TTL y límite de tamaño.
+
+Backends (CACHE_RESPUESTAS):
+  - memoria: LRU dentro del proceso.
+  - disco:   archivos en CACHE_DIR (por defecto /dev/shm, o sea RAM) compartidos
+             por todos los workers.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+
+def canonizar(modelo_id, km_actual, historial):
+    """JSON determinista (claves ordenadas, sin espacios) de la parte relevante del payload."""
+    return json.dumps(
+        {"modelo_id": modelo_id, "km_actual": km_actual, "historial_usuario": historial},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+
+def construir_clave(canonico, *versiones):
+    h = hashlib.sha256()
+    for v in versiones:
+        h.update(str(v).encode('utf-8') + b'\0')
+    h.update(canonico.encode('utf-8'))
+    return h.hexdigest()
+
+def calcular_etag(cuerpo):
+    return hashlib.sha256(cuerpo).hexdigest()[:32]
+
+def hash_archivo(ruta):
+    """Versión de un artefacto (modelo, base.json) a partir de su contenido."""
+    if not os.path.exists(ruta): return "ausente"
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloque)
+    return h.hexdigest()[:16]
+
+
+class CacheMemoria:
+    """LRU en proceso limitado por bytes totales de las respuestas."""
+
+    def __init__(self, ttl=30, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()  # clave -> (expira, etag, cuerpo)
+        self._bytes = 0
+        self._lock = Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None: return None
+            expira, etag, cuerpo = entrada
+            if expira < time.time():
+                self._eliminar(clave)
+                return None
+            self._datos.move_to_end(clave)
+            return etag, cuerpo
+
+    def guardar(self, clave, etag, cuerpo):
+        if len(cuerpo) > self.max_bytes: return
+        with self._lock:
+            if clave in self._datos:
+                self._eliminar(clave)
+            self._datos[clave] = (time.time() + self.ttl, etag, cuerpo)
+            self._bytes += len(cuerpo)
+            while self._bytes > self.max_bytes:
+                self._eliminar(next(iter(self._datos)))
+
+    def _eliminar(self, clave):
+        _, _, cuerpo = self._datos.pop(clave)
+        self._bytes -= len(cuerpo)
+
+
+class CacheDisco:
+    """
+    Un archivo por clave: primera línea con {"expira", "etag"} y después el cuerpo.
+    Escrituras atómicas (tmp + os.replace) para que varios workers compartan el
+    directorio. La expulsión borra los archivos con mtime más antiguo (el mtime
+    se actualiza en cada acierto, así que se comporta como un LRU aproximado).
+    """
+
+    # Escaneo completo del directorio como mucho cada N escrituras (o antes si la
+    # estimación supera el límite). La estimación solo ve las escrituras de este
+    # proceso, el escaneo periódico recoge las de los demás workers.
+    ESCANEO_CADA = 200
+    TMP_HUERFANO_SEG = 60  # Un .tmp más viejo que esto ya no está en escritura
+
+    def __init__(self, directorio, ttl=30, max_bytes=64 * 1024 * 1024):
+        self.directorio = directorio
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directorio, exist_ok=True)
+        self._bytes_estimados = None  # None = aún sin escanear
+        self._escrituras = 0
+        self._lock = Lock()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave + '.cache')
+
+    def obtener(self, clave):
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                linea = f.readline()
+                cuerpo = f.read()
+        except OSError:
+            return None
+        try:
+            cabecera = json.loads(linea)
+            expira, etag = float(cabecera["expira"]), str(cabecera["etag"])
+        except (ValueError, KeyError, TypeError):
+            # Archivo ajeno o corrupto en el directorio compartido
+            self._borrar(ruta)
+            return None
+        if expira < time.time():
+            self._borrar(ruta)
+            return None
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return etag, cuerpo
+
+    def guardar(self, clave, etag, cuerpo):
+        if len(cuerpo) > self.max_bytes: return
+        cabecera = json.dumps({"expira": time.time() + self.ttl, "etag": etag}).encode('utf-8')
+        tmp = os.path.join(self.directorio, f".{clave}.{uuid.uuid4().hex[:8]}.tmp")
+        # Best-effort: un fallo de escritura (ENOSPC, permisos...) no debe tumbar la respuesta
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(cabecera + b'\n' + cuerpo)
+            os.replace(tmp, self._ruta(clave))
+        except OSError as e:
+            print(f"⚠️ Caché: no se pudo guardar la entrada ({e})")
+            self._borrar(tmp)
+            return
+
+        with self._lock:
+            self._escrituras += 1
+            if self._bytes_estimados is not None:
+                self._bytes_estimados += len(cabecera) + 1 + len(cuerpo)
+            escanear = (self._bytes_estimados is None
+                        or self._bytes_estimados > self.max_bytes
+                        or self._escrituras >= self.ESCANEO_CADA)
+            if escanear:
+                self._escrituras = 0
+        if escanear:
+            self._expulsar()
+
+    def _expulsar(self):
+        entradas = []
+        total = 0
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError:
+            return
+        ahora = time.time()
+        for nombre in nombres:
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                st = os.stat(ruta)
+            except OSError:
+                continue
+            if nombre.endswith('.tmp'):
+                # Temporales huérfanos de escrituras fallidas o workers caídos
+                if st.st_mtime < ahora - self.TMP_HUERFANO_SEG:
+                    self._borrar(ruta)
+                continue
+            if not nombre.endswith('.cache'): continue
+            entradas.append((st.st_mtime, st.st_size, ruta))
+            total += st.st_size
+
+        if total > self.max_bytes:
+            for mtime, tamano, ruta in sorted(entradas):
+                self._borrar(ruta)
+                total -= tamano
+                if total <= self.max_bytes: break
+        self._bytes_estimados = total
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def crear_desde_entorno():
+    """Devuelve el backend configurado o None si la caché está desactivada."""
+    tipo = os.getenv("CACHE_RESPUESTAS", "off").lower()
+    ttl = float(os.getenv("CACHE_TTL", "30"))
+    max_bytes = int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+    if tipo == 'memoria':
+        return CacheMemoria(ttl=ttl, max_bytes=max_bytes)
+    if tipo == 'disco':
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        directorio = os.getenv("CACHE_DIR", os.path.join(base, 'bimmo_cache'))
+        return CacheDisco(directorio, ttl=ttl, max_bytes=max_bytes)
+    return None
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+INGENIERÍA DE CARACTERÍSTICAS COMPARTIDA (servidor, entrenamiento y generador).
+Única fuente de verdad para las features del modelo y la matemática de ciclos.
+Todo está vectorizado con NumPy: acepta escalares, listas o arrays de cualquier tamaño.
+
+El esquema (versión + columnas) se guarda junto a los artefactos del modelo
+(esquema_features.json) y el servidor se niega a cargar un modelo cuyo esquema
+no coincida con el de este módulo.
+
+Benchmark:  python caracteristicas.py
+"""
+
+import json
+import os
+import numpy as np
+
+# Subir la versión ante CUALQUIER cambio en las columnas o en su cálculo
+VERSION_ESQUEMA = 1
+EPSILON = 1e-6
+KM_MAXIMO = 10_000_000  # Cota de cordura para kilometrajes reportados
+COLUMNAS = ['km_pieza', 'intervalo', 'ratio_uso', 'diferencia_km']
+ARCHIVO_ESQUEMA = 'esquema_features.json'
+
+
+def construir_features(km_pieza, intervalo):
+    """
+    Devuelve una matriz (n, 4) float64 con las columnas de COLUMNAS.
+    km_pieza / intervalo pueden ser escalares o arrays de la misma longitud.
+    """
+    km = np.atleast_1d(np.asarray(km_pieza, dtype=np.float64))
+    inter = np.atleast_1d(np.asarray(intervalo, dtype=np.float64))
+    km, inter = np.broadcast_arrays(km, inter)
+
+    X = np.empty((km.shape[0], len(COLUMNAS)), dtype=np.float64)
+    X[:, 0] = km
+    X[:, 1] = inter
+    np.divide(km, inter + EPSILON, out=X[:, 2])
+    np.subtract(km, inter, out=X[:, 3])
+    return X
+
+
+# --- MATEMÁTICA DE CICLOS ---
+
+def km_fin_ciclo(intervalo, ciclo):
+    """Kilometraje en el que termina el ciclo `ciclo` (1 = primer cambio)."""
+    return np.asarray(intervalo) * np.asarray(ciclo)
+
+def km_en_ciclo(intervalo, ciclo, ratio):
+    """Km reales tras completar ciclo-1 cambios y recorrer `ratio` del ciclo actual."""
+    intervalo = np.asarray(intervalo, dtype=np.float64)
+    return intervalo * (np.asarray(ciclo) - 1) + intervalo * np.asarray(ratio)
+
+def km_recomendado(km_realizado, intervalo):
+    """
+    km_recomendacion_app: final del ciclo más cercano al km reportado (mínimo el 1er ciclo).
+    Devuelve 0 donde el intervalo no es positivo o no hay km.
+    np.round redondea al par, igual que round() de Python.
+    Lanza ValueError con valores no finitos o fuera de ±KM_MAXIMO (el cast a
+    int64 los convertiría en basura en lugar de fallar).
+    """
+    km = np.atleast_1d(np.asarray(km_realizado, dtype=np.float64))
+    inter = np.atleast_1d(np.asarray(intervalo, dtype=np.float64))
+    for nombre, valores in (("km_realizado", km), ("intervalo", inter)):
+        if not np.all(np.isfinite(valores)) or np.any(np.abs(valores) > KM_MAXIMO):
+            raise ValueError(f"{nombre} debe ser finito y no superar {KM_MAXIMO} km")
+    validos = (inter > 0) & (km != 0)
+
+    ratio = np.divide(km, inter, out=np.zeros_like(km), where=validos)
+    ciclos = np.maximum(1, np.round(ratio))
+    return np.where(validos, km_fin_ciclo(inter, ciclos), 0).astype(np.int64)
+
+
+# --- ESQUEMA ---
+
+def esquema():
+    return {"version": VERSION_ESQUEMA, "columnas": COLUMNAS, "epsilon": EPSILON}
+
+def guardar_esquema(directorio):
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, ARCHIVO_ESQUEMA), 'w', encoding='utf-8') as f:
+        json.dump(esquema(), f, indent=2)
+
+def verificar_esquema(directorio):
+    """Lanza ValueError si el modelo de `directorio` no usa el esquema actual."""
+    ruta = os.path.join(directorio, ARCHIVO_ESQUEMA)
+    if not os.path.exists(ruta):
+        raise ValueError(f"El modelo no declara esquema de features ({ARCHIVO_ESQUEMA})")
+    with open(ruta, 'r', encoding='utf-8') as f:
+        guardado = json.load(f)
+    if guardado != esquema():
+        raise ValueError(f"Esquema de features incompatible: modelo {guardado} vs servidor {esquema()}")
+
+
+if __name__ == '__main__':
+    import time
+
+    print(f"--- BENCHMARK construir_features (esquema v{VERSION_ESQUEMA}) ---")
+    rng = np.random.default_rng(42)
+    for n in (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000):
+        km = rng.uniform(0, 50_000, n)
+        inter = rng.choice([500, 2500, 5000, 10000, 15000], n).astype(np.float64)
+        repeticiones = max(3, min(10_000, 1_000_000 // n))
+
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            construir_features(km, inter)
+        total = (time.perf_counter() - inicio) / repeticiones
+
+        print(f"   n={n:>9,} | {total * 1e3:>10.4f} ms/lote | {total / n * 1e9:>10.1f} ns/fila")
@@ -11,6 +11,7 @@ import random
 import uuid
 import os
 from datetime import datetime, timedelta
+import caracteristicas
 
 # --- CONFIGURACIÓN ---
 CANTIDAD_REGISTROS = 50000 
@@ -85,10 +86,10 @@ def simular_reporte_balanceado(moto_key, moto_data, usuario_id):
 
     # 4. Calcular Kilometraje Real Matemáticamente
     # Formula: (Ciclos Completos * Intervalo) + (Fracción del Ciclo Actual * Intervalo)
-    km_realizado = int((intervalo_base * (ciclo - 1)) + (intervalo_base * ratio))
+    km_realizado = int(caracteristicas.km_en_ciclo(intervalo_base, ciclo, ratio))
     
     # El "recomendado" siempre es el final del ciclo actual
-    km_objetivo = intervalo_base * ciclo
+    km_objetivo = int(caracteristicas.km_fin_ciclo(intervalo_base, ciclo))
 
     return {
         "fecha_reporte": generar_fecha_aleatoria(),
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+PERFILADO BAJO DEMANDA POR PETICIÓN (cProfile).
+Permite perfilar solo la petición lenta en producción:
+  - por muestreo (PERFILADO_TASA, ej. 0.01 = 1% de las peticiones), o
+  - a demanda con la cabecera X-Perfilar: <PERFILADO_TOKEN> (en endpoints con auth).
+Cada perfil se guarda como .prof (pstats) + .json con metadatos de la petición
+en un directorio rotativo que conserva los últimos PERFILADO_MAX archivos.
+
+Uso CLI:  python perfilado.py [--dir DIR] [--top N] [--ultimos N]
+"""
+
+import cProfile
+import pstats
+import io
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+from functools import wraps
+from threading import Lock
+
+from flask import request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DIR_PERFILES_DEFECTO = os.path.join(BASE_DIR, '../results/perfiles/')
+CABECERA = 'X-Perfilar'
+
+# cProfile usa estado global del proceso (sys.monitoring en 3.12+): solo un perfil a la vez
+lock_perfil = Lock()
+
+
+class Perfilador:
+    def __init__(self, directorio=DIR_PERFILES_DEFECTO, tasa=0.0, token=None,
+                 max_perfiles=50, metadatos=None):
+        self.directorio = directorio
+        self.tasa = tasa
+        self.token = token
+        self.max_perfiles = max_perfiles
+        # Función opcional () -> dict con metadatos extra de la petición actual
+        self.metadatos = metadatos
+
+    @property
+    def activo(self):
+        return self.tasa > 0 or bool(self.token)
+
+    @classmethod
+    def desde_entorno(cls, metadatos=None):
+        return cls(
+            directorio=os.getenv("PERFILADO_DIR", DIR_PERFILES_DEFECTO),
+            tasa=float(os.getenv("PERFILADO_TASA", "0")),
+            token=os.getenv("PERFILADO_TOKEN") or None,
+            max_perfiles=int(os.getenv("PERFILADO_MAX", "50")),
+            metadatos=metadatos
+        )
+
+    def _debe_perfilar(self):
+        """Devuelve el disparador ('cabecera' | 'muestreo') o None si no se perfila."""
+        if self.token and request.headers.get(CABECERA) == self.token:
+            return "cabecera"
+        if self.tasa > 0 and random.random() < self.tasa:
+            return "muestreo"
+        return None
+
+    def perfilar(self, f):
+        """
+        Decorador. Si el perfilado está apagado devuelve la función original,
+        así que en ese caso el coste es cero.
+        """
+        if not self.activo:
+            return f
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            disparador = self._debe_perfilar()
+            if not disparador:
+                return f(*args, **kwargs)
+
+            # Si ya hay otra petición perfilándose, esta se atiende sin perfil
+            if not lock_perfil.acquire(blocking=False):
+                return f(*args, **kwargs)
+
+            try:
+                perfil = cProfile.Profile()
+                try:
+                    perfil.enable()
+                except Exception as e:
+                    print(f"⚠️ No se pudo iniciar el perfilado: {e}")
+                    return f(*args, **kwargs)
+
+                inicio = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    perfil.disable()
+                    duracion = time.perf_counter() - inicio
+                    try:
+                        self._guardar(perfil, duracion, disparador)
+                    except Exception as e:
+                        print(f"⚠️ Error guardando perfil: {e}")
+            finally:
+                lock_perfil.release()
+        return decorated
+
+    def _guardar(self, perfil, duracion, disparador):
+        os.makedirs(self.directorio, exist_ok=True)
+        marca = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        nombre = f"{marca}_{request.endpoint}_{uuid.uuid4().hex[:6]}"
+
+        meta = {
+            "nombre": nombre,
+            "fecha": datetime.now().isoformat(),
+            "endpoint": request.endpoint,
+            "metodo": request.method,
+            "ruta": request.path,
+            "duracion_ms": round(duracion * 1000, 2),
+            "disparador": disparador
+        }
+        if self.metadatos:
+            meta.update(self.metadatos())
+
+        perfil.dump_stats(os.path.join(self.directorio, nombre + '.prof'))
+        with open(os.path.join(self.directorio, nombre + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        self._rotar()
+
+    def _rotar(self):
+        for nombre in listar_nombres(self.directorio)[self.max_perfiles:]:
+            # Primero el .json: así el listado deja de verlo antes de borrar el .prof
+            for ext in ('.json', '.prof'):
+                ruta = os.path.join(self.directorio, nombre + ext)
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+
+
+# --- LECTURA / RESUMEN ---
+
+def listar_nombres(directorio):
+    """Nombres de perfil (sin extensión), del más reciente al más antiguo."""
+    if not os.path.isdir(directorio): return []
+    nombres = [f[:-5] for f in os.listdir(directorio) if f.endswith('.json')]
+    return sorted(nombres, reverse=True)
+
+def cargar_metadatos(directorio, nombre):
+    with open(os.path.join(directorio, nombre + '.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def resumir(directorio, nombre, top=15):
+    """
+    Metadatos + las `top` funciones con mayor tiempo acumulado.
+    Lanza FileNotFoundError si el perfil se rotó mientras se leía.
+    """
+    ruta_prof = os.path.join(directorio, nombre + '.prof')
+    stats = pstats.Stats(ruta_prof, stream=io.StringIO())
+
+    funciones = []
+    for (archivo, linea, func), (cc, nc, tt, ct, _) in stats.stats.items():
+        funciones.append({
+            "funcion": f"{os.path.basename(archivo)}:{linea}({func})",
+            "llamadas": nc,
+            "tiempo_propio_ms": round(tt * 1000, 3),
+            "tiempo_acumulado_ms": round(ct * 1000, 3)
+        })
+    funciones.sort(key=lambda x: x["tiempo_acumulado_ms"], reverse=True)
+
+    resumen = cargar_metadatos(directorio, nombre)
+    resumen["top_funciones"] = funciones[:top]
+    return resumen
+
+def listar_recientes(directorio, ultimos=20):
+    recientes = []
+    for n in listar_nombres(directorio)[:ultimos]:
+        try:
+            recientes.append(cargar_metadatos(directorio, n))
+        except FileNotFoundError:
+            continue  # Rotado durante el listado
+    return recientes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Listar y resumir perfiles de peticiones")
+    parser.add_argument('--dir', default=os.getenv("PERFILADO_DIR", DIR_PERFILES_DEFECTO))
+    parser.add_argument('--ultimos', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    nombres = listar_nombres(args.dir)[:args.ultimos]
+    if not nombres:
+        print(f"📭 No hay perfiles en {args.dir}")
+
+    for nombre in nombres:
+        try:
+            r = resumir(args.dir, nombre, top=args.top)
+        except FileNotFoundError:
+            continue
+        print(f"\n📈 {r['fecha']} | {r['endpoint']} | {r['duracion_ms']} ms | "
+              f"modelo: {r.get('modelo_id')} | tareas: {r.get('num_tareas')}")
+        for fn in r["top_funciones"]:
+            print(f"   {fn['tiempo_acumulado_ms']:>10.3f} ms  {fn['llamadas']:>6}x  {fn['funcion']}")
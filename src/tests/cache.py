@@ -0,0 +1,56 @@
+import requests
+import random
+import os
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+# --- CONFIGURACIÓN ---
+# El servidor debe arrancar con CACHE_RESPUESTAS=memoria (o disco)
+URL_API = 'http://127.0.0.1:5000/predict_full'
+
+USUARIO = os.getenv("AUTH_USERNAME", "admin")
+PASSWORD = os.getenv("AUTH_PASSWORD", "secret")
+
+# KM aleatorio para que la primera petición no caiga en una entrada de otra ejecución
+payload = {
+    "modelo_id": "Hero_Hunk_160R_4V",
+    "km_actual": random.randint(1000, 50000),
+    "historial_usuario": {}
+}
+
+def comprobar(nombre, condicion, detalle):
+    print(f"{'✅' if condicion else '❌'} {nombre}: {detalle}")
+    return condicion
+
+print(f"\n🚀 Probando caché de respuestas en {URL_API}...")
+print(f"📋 Datos: Moto {payload['modelo_id']} con {payload['km_actual']} km\n")
+
+try:
+    auth = (USUARIO, PASSWORD)
+    ok = True
+
+    # 1. Primera petición -> se calcula (MISS)
+    r1 = requests.post(URL_API, json=payload, auth=auth)
+    ok &= comprobar("1ª petición", r1.status_code == 200 and r1.headers.get('X-Cache') == 'MISS',
+                    f"{r1.status_code} X-Cache={r1.headers.get('X-Cache')}")
+
+    # 2. Mismo payload -> sale de la caché (HIT) con los mismos bytes
+    r2 = requests.post(URL_API, json=payload, auth=auth)
+    ok &= comprobar("2ª petición", r2.status_code == 200 and r2.headers.get('X-Cache') == 'HIT'
+                    and r2.content == r1.content,
+                    f"{r2.status_code} X-Cache={r2.headers.get('X-Cache')}")
+
+    # 3. Con el ETag devuelto -> 304 sin cuerpo
+    etag = r2.headers.get('ETag')
+    r3 = requests.post(URL_API, json=payload, auth=auth, headers={'If-None-Match': etag})
+    ok &= comprobar("If-None-Match", r3.status_code == 304 and not r3.content,
+                    f"{r3.status_code} ETag={etag} cuerpo={len(r3.content)} bytes")
+
+    print("\n🏁 Caché OK" if ok else "\n⚠️ La caché no se comporta como se esperaba "
+          "(¿arrancaste el servidor con CACHE_RESPUESTAS=memoria?)")
+
+except Exception as e:
+    print(f"❌ Error de conexión: {e}")
+    print("   ¿Está el servidor corriendo? (python app.py)")
@@ -0,0 +1,76 @@
+import requests
+import json
+import os
+import uuid
+from dotenv import load_dotenv
+
+# Cargar credenciales del archivo .env (si existe) para no escribirlas manual
+load_dotenv()
+
+# CONFIGURACIÓN
+# ---------------------------------------------------------
+URL_API = 'http://127.0.0.1:5000/reportar_mantenimiento_batch'
+
+USUARIO = os.getenv("AUTH_USERNAME")
+PASSWORD = os.getenv("AUTH_PASSWORD")
+# ---------------------------------------------------------
+
+# DATOS DE PRUEBA (Sincronización offline de la app)
+# Varios reportes en una sola llamada. El tercero repite la clave del primero
+# (reintento de subida) y el último es inválido (sin componente).
+clave_repetida = uuid.uuid4().hex
+payload = [
+    {
+        "clave_idempotencia": clave_repetida,
+        "usuario_id_hash": "test_user_123",
+        "modelo_id": "Bajaj_Pulsar_NS200",
+        "componente_id": "bujias",
+        "accion_realizada": "REEMPLAZAR",
+        "km_realizado_usuario": 12500,
+        "condicion_reportada": "muy_desgastado"
+    },
+    {
+        "clave_idempotencia": uuid.uuid4().hex,
+        "usuario_id_hash": "test_user_123",
+        "modelo_id": "Bajaj_Pulsar_NS200",
+        "componente_id": "filtro_aire",
+        "accion_realizada": "REEMPLAZAR",
+        "km_realizado_usuario": 14000,
+        "condicion_reportada": "desgaste_normal"
+    },
+    {
+        "clave_idempotencia": clave_repetida,
+        "usuario_id_hash": "test_user_123",
+        "modelo_id": "Bajaj_Pulsar_NS200",
+        "componente_id": "bujias",
+        "km_realizado_usuario": 12500,
+        "condicion_reportada": "muy_desgastado"
+    },
+    {
+        "usuario_id_hash": "test_user_123",
+        "modelo_id": "Bajaj_Pulsar_NS200",
+        "km_realizado_usuario": 9000
+    }
+]
+
+print(f"\n🚀 Enviando lote de {len(payload)} reportes al servidor IA...\n")
+
+try:
+    response = requests.post(
+        URL_API,
+        json=payload,
+        auth=(USUARIO, PASSWORD) # Autenticación Básica
+    )
+
+    if response.status_code in (200, 201):
+        data = response.json()
+        print("\n✅ ¡ÉXITO! Respuesta del Servidor:\n")
+        print(f"Resumen: {data['resumen']}")
+        for r in data["resultados"]:
+            print(f"   [{r['indice']}] {r['status']} {r.get('error', '')}")
+    else:
+        print(f"❌ Error {response.status_code}: {response.text}")
+
+except Exception as e:
+    print(f"❌ Error de conexión: {e}")
+    print("   ¿Está el servidor corriendo? (python app.py)")
@@ -12,11 +12,25 @@ from tensorflow.keras.layers import Dense, Dropout, BatchNormalization
 from tensorflow.keras.utils import to_categorical
 import matplotlib.pyplot as plt
 import seaborn as sns
+import argparse
+import time
 import os
+import caracteristicas
 
 # --- CONFIGURACIÓN ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ARCHIVO_DATOS = os.path.join(BASE_DIR, '../data/datos_entrenamiento_fase5.jsonl')
+DIR_CHECKPOINTS = os.path.join(BASE_DIR, '../models/checkpoints/')
+
+EPOCHS_MAX = 200
+BATCH_SIZE = 64
+METRICA_MONITOR = 'val_loss'   # Métrica de validación para early stopping
+PACIENCIA = 15                 # Épocas sin mejora antes de detener
+MIN_DELTA = 1e-4               # Mejora mínima que cuenta como progreso
+FRECUENCIA_CHECKPOINT = 5      # Guardar checkpoint cada N épocas
+PRESUPUESTO_MINUTOS = None     # Límite de tiempo (None = sin límite)
+HILOS_INTRA = 0                # 0 = TensorFlow decide
+HILOS_INTER = 0
 
 def cargar_datos(ruta):
     data = []
@@ -26,22 +40,29 @@ def cargar_datos(ruta):
             data.append(json.loads(line))
     return pd.DataFrame(data)
 
-def preprocesar_datos(df):
+def preprocesar_datos(df, scaler=None, encoder=None):
+    """
+    Si se pasan scaler/encoder (p. ej. al reanudar desde un checkpoint) se
+    reutilizan tal cual en lugar de ajustarlos de nuevo.
+    """
     print("⚙️  Preprocesando e Ingeniería de Características...")
     
-    # 1. INGENIERÍA DE CARACTERÍSTICAS
-    epsilon = 1e-6
-    df['ratio_uso'] = df['km_realizado_usuario'] / (df['km_recomendacion_app'] + epsilon)
-    df['diferencia_km'] = df['km_realizado_usuario'] - df['km_recomendacion_app']
-    
-    features = ['km_realizado_usuario', 'km_recomendacion_app', 'ratio_uso', 'diferencia_km']
-    X = df[features].values
+    # 1. INGENIERÍA DE CARACTERÍSTICAS (módulo compartido con el servidor)
+    X = caracteristicas.construir_features(
+        df['km_realizado_usuario'].to_numpy(), df['km_recomendacion_app'].to_numpy()
+    )
     
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    if scaler is None:
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+    else:
+        X_scaled = scaler.transform(X)
     
-    encoder = LabelEncoder()
-    y_int = encoder.fit_transform(df['condicion_reportada'])
+    if encoder is None:
+        encoder = LabelEncoder()
+        y_int = encoder.fit_transform(df['condicion_reportada'])
+    else:
+        y_int = encoder.transform(df['condicion_reportada'])
     y_onehot = to_categorical(y_int)
     
     class_names = encoder.classes_
@@ -71,6 +92,238 @@ def construir_modelo_robusto(input_dim, num_classes):
     )
     return model
 
+def configurar_hilos(intra, inter):
+    """Debe llamarse antes de que TensorFlow ejecute cualquier operación."""
+    if intra:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+    if inter:
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+    print(f"🧵 Hilos TF -> intra: {intra or 'auto'} | inter: {inter or 'auto'}")
+
+# --- CHECKPOINTS ---
+# Un checkpoint es una carpeta con:
+#   modelo.keras        -> pesos + estado del optimizador
+#   mejor_modelo.keras  -> mejores pesos según METRICA_MONITOR
+#   scaler.pkl / encoder.pkl / esquema_features.json
+#   estado.json         -> época, early stopping, tiempo consumido e historial
+
+def _ruta_ckpt(dir_ckpt, nombre):
+    return os.path.join(dir_ckpt, nombre)
+
+def _guardar_json_atomico(datos, ruta):
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, indent=2)
+    os.replace(tmp, ruta)
+
+def _guardar_modelo_atomico(model, ruta):
+    # Keras exige la extensión .keras, así que el temporal la conserva
+    tmp = ruta[:-len('.keras')] + '.tmp.keras'
+    model.save(tmp)
+    os.replace(tmp, ruta)
+
+def archivar_checkpoint(dir_ckpt):
+    """
+    Al empezar desde cero, mueve el checkpoint anterior a dir_ckpt/anterior/ para
+    que un --reanudar nunca mezcle su modelo/estado con los preprocesadores nuevos.
+    """
+    archivos = ('modelo.keras', 'mejor_modelo.keras', 'estado.json',
+                'scaler.pkl', 'encoder.pkl', caracteristicas.ARCHIVO_ESQUEMA)
+    existentes = [n for n in archivos if os.path.exists(_ruta_ckpt(dir_ckpt, n))]
+    if not existentes: return
+
+    dir_anterior = _ruta_ckpt(dir_ckpt, 'anterior')
+    os.makedirs(dir_anterior, exist_ok=True)
+    for n in archivos:
+        destino = os.path.join(dir_anterior, n)
+        if os.path.exists(destino):
+            os.remove(destino)
+    for n in existentes:
+        os.replace(_ruta_ckpt(dir_ckpt, n), os.path.join(dir_anterior, n))
+    print(f"🗄️  Checkpoint anterior archivado en {dir_anterior}")
+
+def guardar_preprocesadores(dir_ckpt, scaler, encoder):
+    os.makedirs(dir_ckpt, exist_ok=True)
+    with open(_ruta_ckpt(dir_ckpt, 'scaler.pkl'), 'wb') as f:
+        pickle.dump(scaler, f)
+    with open(_ruta_ckpt(dir_ckpt, 'encoder.pkl'), 'wb') as f:
+        pickle.dump(encoder, f)
+    caracteristicas.guardar_esquema(dir_ckpt)
+
+def cargar_checkpoint(dir_ckpt):
+    """
+    Devuelve (model, scaler, encoder, estado) o None si no hay checkpoint completo.
+    """
+    rutas = [_ruta_ckpt(dir_ckpt, n) for n in ('modelo.keras', 'scaler.pkl', 'encoder.pkl', 'estado.json')]
+    if not all(os.path.exists(r) for r in rutas):
+        return None
+    caracteristicas.verificar_esquema(dir_ckpt)
+
+    model = tf.keras.models.load_model(rutas[0])
+    with open(rutas[1], 'rb') as f:
+        scaler = pickle.load(f)
+    with open(rutas[2], 'rb') as f:
+        encoder = pickle.load(f)
+    with open(rutas[3], 'r', encoding='utf-8') as f:
+        estado = json.load(f)
+
+    print(f"♻️  Checkpoint cargado: época {estado['epoca']} "
+          f"({estado['segundos_consumidos']:.0f}s consumidos)")
+    return model, scaler, encoder, estado
+
+class ControlEntrenamiento(tf.keras.callbacks.Callback):
+    """
+    Early stopping + checkpoints periódicos + presupuesto de tiempo.
+    Todo su estado se persiste en estado.json para que al reanudar la
+    paciencia, el mejor valor y el tiempo consumido continúen donde quedaron.
+    También registra duración y muestras/segundo de cada época.
+    """
+
+    def __init__(self, dir_ckpt, n_muestras, estado=None, monitor=METRICA_MONITOR,
+                 paciencia=PACIENCIA, min_delta=MIN_DELTA,
+                 frecuencia=FRECUENCIA_CHECKPOINT, presupuesto_seg=None):
+        super().__init__()
+        estado = estado or {}
+        self.dir_ckpt = dir_ckpt
+        self.n_muestras = n_muestras
+        self.monitor = monitor
+        self.paciencia = paciencia
+        self.min_delta = min_delta
+        self.frecuencia = frecuencia
+        self.presupuesto_seg = presupuesto_seg
+        # 'loss' se minimiza, 'accuracy' se maximiza
+        self.modo_max = 'acc' in monitor
+
+        self.epoca = estado.get('epoca', 0)
+        self.mejor = estado.get('mejor', None)
+        self.mejor_epoca = estado.get('mejor_epoca', None)
+        self.espera = estado.get('espera', 0)
+        self.segundos_previos = estado.get('segundos_consumidos', 0.0)
+        self.historial = estado.get('historial', {})
+        self.motivo_parada = None
+
+    def _mejora(self, valor):
+        if self.mejor is None:
+            return True
+        if self.modo_max:
+            return valor > self.mejor + self.min_delta
+        return valor < self.mejor - self.min_delta
+
+    def segundos_consumidos(self):
+        return self.segundos_previos + (time.perf_counter() - self._inicio)
+
+    def on_train_begin(self, logs=None):
+        self._inicio = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._inicio_epoca = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        duracion = time.perf_counter() - self._inicio_epoca
+        muestras_seg = self.n_muestras / duracion if duracion > 0 else 0.0
+        self.epoca = epoch + 1
+
+        for k, v in logs.items():
+            self.historial.setdefault(k, []).append(float(v))
+        self.historial.setdefault('segundos_epoca', []).append(duracion)
+        self.historial.setdefault('muestras_seg', []).append(muestras_seg)
+
+        print(f"⏱️  Época {self.epoca}: {duracion:.2f}s | {muestras_seg:,.0f} muestras/s | "
+              f"{self.monitor}: {logs.get(self.monitor, float('nan')):.4f}")
+
+        # 1. Early stopping
+        valor = logs.get(self.monitor)
+        mejoro = False
+        if valor is not None:
+            if self._mejora(valor):
+                self.mejor, self.mejor_epoca, self.espera = float(valor), self.epoca, 0
+                _guardar_modelo_atomico(self.model, _ruta_ckpt(self.dir_ckpt, 'mejor_modelo.keras'))
+                mejoro = True
+            else:
+                self.espera += 1
+                if self.espera >= self.paciencia:
+                    self.motivo_parada = 'early_stopping'
+
+        # 2. Presupuesto de tiempo (de esta ejecución): paramos si la próxima época no cabe
+        if self.presupuesto_seg is not None and self.motivo_parada is None:
+            if (time.perf_counter() - self._inicio) + duracion > self.presupuesto_seg:
+                self.motivo_parada = 'presupuesto_tiempo'
+
+        if self.motivo_parada:
+            self.model.stop_training = True
+
+        # 3. Checkpoint periódico, y siempre al detenerse o al mejorar: así estado.json
+        #    (mejor, mejor_epoca) nunca queda por detrás de mejor_modelo.keras
+        if mejoro or self.motivo_parada or self.epoca % self.frecuencia == 0:
+            self.guardar()
+
+    def on_train_end(self, logs=None):
+        if self.motivo_parada is None:
+            self.motivo_parada = 'epocas_completadas'
+        self.guardar()
+
+        if self.motivo_parada == 'early_stopping':
+            print(f"🛑 Early stopping: sin mejora en {self.monitor} durante {self.paciencia} épocas")
+        elif self.motivo_parada == 'presupuesto_tiempo':
+            print(f"⌛ Presupuesto de tiempo agotado ({self.presupuesto_seg:.0f}s). "
+                  f"Reanuda con --reanudar")
+
+        # Restaurar los mejores pesos, como restore_best_weights de Keras
+        ruta_mejor = _ruta_ckpt(self.dir_ckpt, 'mejor_modelo.keras')
+        if self.mejor_epoca is not None and os.path.exists(ruta_mejor):
+            self.model.set_weights(tf.keras.models.load_model(ruta_mejor).get_weights())
+            print(f"↩️  Restaurados pesos de la época {self.mejor_epoca} ({self.monitor}={self.mejor:.4f})")
+
+    def guardar(self):
+        _guardar_modelo_atomico(self.model, _ruta_ckpt(self.dir_ckpt, 'modelo.keras'))
+        _guardar_json_atomico({
+            "epoca": self.epoca,
+            "monitor": self.monitor,
+            "mejor": self.mejor,
+            "mejor_epoca": self.mejor_epoca,
+            "espera": self.espera,
+            "segundos_consumidos": self.segundos_consumidos(),
+            "motivo_parada": self.motivo_parada,
+            "historial": self.historial
+        }, _ruta_ckpt(self.dir_ckpt, 'estado.json'))
+        print(f"💾 Checkpoint guardado (época {self.epoca})")
+
+def _entero_positivo(texto):
+    valor = int(texto)
+    if valor < 1:
+        raise argparse.ArgumentTypeError(f"debe ser >= 1 (recibido {valor})")
+    return valor
+
+def _entero_no_negativo(texto):
+    valor = int(texto)
+    if valor < 0:
+        raise argparse.ArgumentTypeError(f"debe ser >= 0 (recibido {valor})")
+    return valor
+
+def _float_positivo(texto):
+    valor = float(texto)
+    if not valor > 0 or valor == float('inf'):
+        raise argparse.ArgumentTypeError(f"debe ser un número > 0 (recibido {texto})")
+    return valor
+
+def parsear_argumentos():
+    # Se valida aquí para fallar antes de cargar datos, no a mitad de entrenamiento
+    parser = argparse.ArgumentParser(description="Entrenamiento del modelo de desgaste")
+    parser.add_argument('--epochs', type=_entero_positivo, default=EPOCHS_MAX)
+    parser.add_argument('--batch-size', type=_entero_positivo, default=BATCH_SIZE)
+    parser.add_argument('--paciencia', type=_entero_positivo, default=PACIENCIA)
+    parser.add_argument('--monitor', default=METRICA_MONITOR)
+    parser.add_argument('--frecuencia-checkpoint', type=_entero_positivo, default=FRECUENCIA_CHECKPOINT)
+    parser.add_argument('--presupuesto-min', type=_float_positivo, default=PRESUPUESTO_MINUTOS,
+                        help="Tiempo máximo de esta ejecución en minutos")
+    parser.add_argument('--dir-checkpoints', default=DIR_CHECKPOINTS)
+    parser.add_argument('--reanudar', action='store_true',
+                        help="Continuar desde el último checkpoint si existe")
+    parser.add_argument('--hilos-intra', type=_entero_no_negativo, default=HILOS_INTRA)
+    parser.add_argument('--hilos-inter', type=_entero_no_negativo, default=HILOS_INTER)
+    return parser.parse_args()
+
 def plot_confusion_matrix(y_true, y_pred, classes, out_path):
     # Calcular matriz
     cm = confusion_matrix(y_true, y_pred)
@@ -89,11 +342,25 @@ def plot_confusion_matrix(y_true, y_pred, classes, out_path):
     print(f"📊 Matriz de confusión guardada: {out_path}")
 
 def main():
+    args = parsear_argumentos()
+    configurar_hilos(args.hilos_intra, args.hilos_inter)
+
+    checkpoint = cargar_checkpoint(args.dir_checkpoints) if args.reanudar else None
+    if args.reanudar and checkpoint is None:
+        print("⚠️  No hay checkpoint previo, se empieza desde cero.")
+
     # 1. Cargar
     df = cargar_datos(ARCHIVO_DATOS)
     
-    # 2. Preprocesar (Recibimos scaler y encoder)
-    X, y_onehot, class_names, y_int_total, scaler, encoder = preprocesar_datos(df)
+    # 2. Preprocesar (Recibimos scaler y encoder; al reanudar se reutilizan los guardados)
+    if checkpoint:
+        model, scaler, encoder, estado = checkpoint
+        X, y_onehot, class_names, y_int_total, scaler, encoder = preprocesar_datos(df, scaler, encoder)
+    else:
+        estado = {}
+        X, y_onehot, class_names, y_int_total, scaler, encoder = preprocesar_datos(df)
+        archivar_checkpoint(args.dir_checkpoints)
+        guardar_preprocesadores(args.dir_checkpoints, scaler, encoder)
     
     # 3. Split (Usamos estratificación para mantener balance)
     X_train, X_test, y_train, y_test = train_test_split(
@@ -101,17 +368,37 @@ def main():
     )
     
     # 4. Construir
-    model = construir_modelo_robusto(input_dim=X.shape[1], num_classes=y_onehot.shape[1])
+    if not checkpoint:
+        model = construir_modelo_robusto(input_dim=X.shape[1], num_classes=y_onehot.shape[1])
     
     # 5. Entrenar
-    print("🚀 Iniciando entrenamiento...")
-    history = model.fit(
-        X_train, y_train,
-        validation_data=(X_test, y_test),
-        epochs=200, 
-        batch_size=64,
-        verbose=1
+    presupuesto_seg = args.presupuesto_min * 60 if args.presupuesto_min is not None else None
+    control = ControlEntrenamiento(
+        args.dir_checkpoints, n_muestras=len(X_train), estado=estado,
+        monitor=args.monitor, paciencia=args.paciencia,
+        frecuencia=args.frecuencia_checkpoint, presupuesto_seg=presupuesto_seg
     )
+
+    if estado.get('motivo_parada') == 'early_stopping':
+        print("✅ El checkpoint ya terminó por early stopping, no se reentrena.")
+        model.set_weights(tf.keras.models.load_model(
+            _ruta_ckpt(args.dir_checkpoints, 'mejor_modelo.keras')).get_weights())
+    else:
+        print(f"🚀 Iniciando entrenamiento desde la época {control.epoca}...")
+        model.fit(
+            X_train, y_train,
+            validation_data=(X_test, y_test),
+            epochs=args.epochs,
+            initial_epoch=control.epoca,
+            batch_size=args.batch_size,
+            callbacks=[control],
+            verbose=1
+        )
+    historial = control.historial
+
+    if historial.get('segundos_epoca'):
+        print(f"\n⏱️  Tiempo total: {sum(historial['segundos_epoca']):.1f}s en {len(historial['segundos_epoca'])} épocas "
+              f"| Media: {np.mean(historial['muestras_seg']):,.0f} muestras/s")
     
     # 6. Evaluar
     loss, accuracy = model.evaluate(X_test, y_test, verbose=0)
@@ -150,19 +437,22 @@ def main():
     with open(ruta_encoder, 'wb') as f:
         pickle.dump(encoder, f)
     print(f"💾 Encoder guardado en: {ruta_encoder}")
+
+    caracteristicas.guardar_esquema(os.path.dirname(ruta_modelo))
+    print(f"💾 Esquema de features v{caracteristicas.VERSION_ESQUEMA} guardado")
     # -----------------------------
 
     # Gráfico de historia (Accuracy/Loss)
     plt.figure(figsize=(12, 4))
     plt.subplot(1, 2, 1)
-    plt.plot(history.history['accuracy'], label='Train')
-    plt.plot(history.history['val_accuracy'], label='Val')
+    plt.plot(historial.get('accuracy', []), label='Train')
+    plt.plot(historial.get('val_accuracy', []), label='Val')
     plt.title('Precisión del Modelo')
     plt.legend()
     
     plt.subplot(1, 2, 2)
-    plt.plot(history.history['loss'], label='Train')
-    plt.plot(history.history['val_loss'], label='Val')
+    plt.plot(historial.get('loss', []), label='Train')
+    plt.plot(historial.get('val_loss', []), label='Val')
     plt.title('Pérdida')
     plt.legend()
     